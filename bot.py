@@ -8,10 +8,11 @@
 
 import asyncio
 import os
-import re
-from collections import defaultdict, deque
-from dataclasses import dataclass
-from typing import Deque, Dict, Optional, Tuple
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from typing import Deque, Dict, List, Optional, Set, Tuple
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
@@ -20,9 +21,18 @@ try:
     from pytgcalls.types.input_stream import AudioPiped
 except ModuleNotFoundError:
     from pytgcalls.types import AudioPiped
-from pytgcalls.exceptions import GroupCallNotFoundError, NotInGroupCallError
+from pytgcalls.exceptions import AlreadyJoinedError, GroupCallNotFoundError, NotInGroupCallError
 import yt_dlp
 
+# uvloop's libuv loop is much faster for this socket-heavy workload. The
+# policy must be set before the Client below is created, because Pyrogram
+# grabs the event loop at construction time.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ModuleNotFoundError:
+    pass
+
 # ── Config ────────────────────────────────────────────────────────────────────
 API_ID = int(os.getenv("API_ID", "0"))
 API_HASH = os.getenv("API_HASH", "")
@@ -36,7 +46,8 @@ app = Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN
 pytgcalls = PyTgCalls(app)
 
 YTDL_OPTS = {
-    "format": "bestaudio[ext=webm][acodec=opus]/bestaudio/best",
+    # Single (non-merged) formats only, so yt-dlp always fills info["url"]
+    "format": "bestaudio[acodec^=opus]/bestaudio/best[ext=m4a]/best",
     "noplaylist": True,
     "quiet": True,
     "extract_flat": False,
@@ -44,168 +55,380 @@ YTDL_OPTS = {
     "source_address": "0.0.0.0",
 }
 
-URL_RE = re.compile(r"^(https?://)\S+", re.I)
+# Input-side FFmpeg flags: start decoding without a long probe, and reconnect
+# instead of dying when the remote stream hiccups
+FFMPEG_PARAMS = (
+    "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 "
+    "-probesize 32 -analyzeduration 0 -fflags nobuffer"
+)
+
+# Playback notices (e.g. a run of tracks that fail to resolve) sent within
+# this many seconds of each other are coalesced into a single message
+NOTICE_DELAY = 2.0
 
-@dataclass
+_URL_PREFIXES = ("http://", "https://")
+PLAY_USAGE = "Usage: `/play <song name | YouTube URL>`"
+
+# Resolved stream URLs stay valid for a few hours; keep them well under that
+EXTRACT_CACHE_TTL = 60 * 60
+EXTRACT_CACHE_SIZE = 256
+EXTRACT_WORKERS = 4     # max concurrent yt-dlp extractions (threads)
+# YouTube stream URLs expire after ~6h; re-resolve queued tracks older than this
+STREAM_URL_TTL = 4 * 60 * 60
+# A stream URL extracted this recently can't have expired, so if it fails to
+# start the error is real and re-extracting would just repeat it
+STREAM_URL_FRESH = 5 * 60
+# Safety cap in case a stream-end update never arrives
+TRACK_MAX_SECONDS = 4 * 60 * 60
+
+# (stream_url, title, duration, page_url) as returned by _ydl_extract
+Extracted = Tuple[str, str, Optional[str], str]
+
+@dataclass(slots=True)
 class Track:
-    title: str
-    url: str            # direct audio stream url
-    page_url: str       # original page/video url
+    query: str                      # what was passed to /play (extract cache key)
     requester: str
+    title: str                      # the query until the track is resolved
+    url: Optional[str] = None       # direct audio stream url, set on dequeue
+    page_url: Optional[str] = None  # original page/video url
     duration: Optional[str] = None
+    resolved_at: float = 0.0        # monotonic time the url was extracted
+    display: str = field(init=False)  # cached "title `[duration]`" for replies
+
+    def __post_init__(self) -> None:
+        self._set_display()
+
+    def _set_display(self) -> None:
+        self.display = f"{self.title} `[{self.duration}]`" if self.duration else self.title
+
+    def update(self, result: Extracted, resolved_at: float) -> None:
+        """Store an extraction result and rebuild display."""
+        self.url, self.title, self.duration, self.page_url = result
+        self.resolved_at = resolved_at
+        self._set_display()
 
 # Per-chat queues/state
-queues: Dict[int, Deque[Track]] = defaultdict(deque)
-now_playing: Dict[int, Optional[Track]] = defaultdict(lambda: None)
-locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+# Plain dicts: entries are only created on write paths (/play, _play_loop)
+queues: Dict[int, Deque[Track]] = {}
+now_playing: Dict[int, Optional[Track]] = {}
+player_tasks: Dict[int, asyncio.Task] = {}
+leaving: Set[int] = set()  # chats where /leave is still tearing down the call
+track_end: Dict[int, asyncio.Event] = {}
+_notices: Dict[int, List[str]] = {}  # loop messages waiting to be sent
+_notice_tasks: Set[asyncio.Task] = set()
+
+# query -> (resolved_at, extract result), oldest first
+_extract_cache: "OrderedDict[str, Tuple[float, Extracted]]" = OrderedDict()
+_extract_slots = asyncio.Semaphore(EXTRACT_WORKERS)
+
+# YoutubeDL isn't safe to share between threads, so each extraction borrows
+# one of these long-lived instances (keeps connections and extractors warm).
+# An instance and its _extract_slots slot are taken and returned together.
+_ydl_pool: List[yt_dlp.YoutubeDL] = [yt_dlp.YoutubeDL(YTDL_OPTS) for _ in range(EXTRACT_WORKERS)]
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
-def _ydl_extract(query: str) -> Tuple[str, str, Optional[str], str]:
+def _is_url(query: str) -> bool:
+    return query[:8].lower().startswith(_URL_PREFIXES)
+
+@lru_cache(maxsize=4096)
+def _fmt_duration(secs: int) -> str:
+    """Seconds -> m:ss, or h:mm:ss from an hour up."""
+    if secs >= 3600:
+        h, rem = divmod(secs, 3600)
+        return "%d:%02d:%02d" % (h, *divmod(rem, 60))
+    return "%d:%02d" % divmod(secs, 60)
+
+def _query_error(query: str) -> Optional[str]:
+    """Why a /play query can't be queued, or None if it is worth extracting."""
+    if not query:
+        return PLAY_USAGE
+    if _is_url(query):
+        host = query.partition("://")[2]
+        if not host or host.startswith("/") or any(c.isspace() for c in query):
+            return "❌ That doesn't look like a valid URL."
+    return None
+
+def _ydl_extract(ydl: yt_dlp.YoutubeDL, query: str) -> Extracted:
     """Return (stream_url, title, duration, page_url) from query or URL."""
-    q = query if URL_RE.match(query) else f"ytsearch1:{query}"
-    with yt_dlp.YoutubeDL(YTDL_OPTS) as ydl:
-        info = ydl.extract_info(q, download=False)
+    if _is_url(query):
+        info = ydl.extract_info(query, download=False)
         if "entries" in info:
             info = info["entries"][0]
-        title = info.get("title") or "Unknown"
-        duration = None
-        if info.get("duration"):
-            secs = int(info["duration"])
-            h, rem = divmod(secs, 3600)
-            m, s = divmod(rem, 60)
-            duration = f"{h:d}:{m:02d}:{s:02d}" if h else f"{m:d}:{s:02d}"
-        page_url = info.get("webpage_url") or info.get("original_url") or query
-
-        # get best audio-only stream url
-        stream_url = info.get("url")
-        if not stream_url or not info.get("acodec"):
-            fmts = info.get("formats") or []
-            audio = next((f for f in fmts if f.get("acodec") and not f.get("video_codec")), None)
-            stream_url = (audio or (fmts[-1] if fmts else {})).get("url")
-        if not stream_url:
-            raise RuntimeError("Couldn't extract audio stream URL")
-        return stream_url, title, duration, page_url
+    else:
+        # Take the raw search hit and only resolve formats for that one entry
+        results = ydl.extract_info(f"ytsearch1:{query}", download=False, process=False)
+        entry = next(iter(results.get("entries") or ()), None)
+        if entry is None:
+            raise RuntimeError("No results found")
+        info = ydl.process_ie_result(entry, download=False)
+    title = info.get("title") or "Unknown"
+    duration = _fmt_duration(int(info["duration"])) if info.get("duration") else None
+    page_url = info.get("webpage_url") or info.get("original_url") or query
+
+    # the format selector already picked the audio stream
+    stream_url = info.get("url")
+    if not stream_url:
+        raise RuntimeError("Couldn't extract audio stream URL")
+    return stream_url, title, duration, page_url
+
+def _cache_key(query: str) -> str:
+    query = query.strip()
+    # URLs are case-sensitive (video ids), search terms are not
+    return query if _is_url(query) else query.lower()
+
+def _extract_cached(query: str) -> Optional[Tuple[float, Extracted]]:
+    """Return a fresh cached (resolved_at, result) for query, without any network work."""
+    key = _cache_key(query)
+    hit = _extract_cache.get(key)
+    if hit and time.monotonic() - hit[0] < EXTRACT_CACHE_TTL:
+        _extract_cache.move_to_end(key)
+        return hit
+    return None
+
+def _release_ydl(ydl: yt_dlp.YoutubeDL, work: asyncio.Future) -> None:
+    _ydl_pool.append(ydl)
+    _extract_slots.release()
+    if not work.cancelled():
+        work.exception()  # mark retrieved so an abandoned failure isn't logged
+
+async def _extract(query: str) -> Tuple[float, Extracted]:
+    """Cached _ydl_extract, run in a worker thread so the event loop keeps going."""
+    hit = _extract_cached(query)
+    if hit:
+        return hit
+    await _extract_slots.acquire()
+    ydl = _ydl_pool.pop()
+    work = asyncio.ensure_future(asyncio.to_thread(_ydl_extract, ydl, query))
+    work.add_done_callback(partial(_release_ydl, ydl))
+    # If our caller is cancelled (e.g. /leave) the thread still runs to the
+    # end; its YoutubeDL and slot go back only once it has finished.
+    result = await asyncio.shield(work)
+    key = _cache_key(query)
+    entry = _extract_cache[key] = (time.monotonic(), result)
+    _extract_cache.move_to_end(key)
+    while len(_extract_cache) > EXTRACT_CACHE_SIZE:
+        _extract_cache.popitem(last=False)
+    return entry
+
+def _extract_invalidate(query: str) -> None:
+    _extract_cache.pop(_cache_key(query), None)
+
+async def _resolve(track: Track, force: bool = False) -> None:
+    """Extract a track's stream URL if missing or stale, or always with force."""
+    if not force and track.url and time.monotonic() - track.resolved_at < STREAM_URL_TTL:
+        return
+    if force:
+        _extract_invalidate(track.query)
+    resolved_at, result = await _extract(track.query)
+    track.update(result, resolved_at)
+
+def _audio(url: str) -> AudioPiped:
+    # AudioPiped reads raw PCM from FFmpeg and the call library does the Opus
+    # encoding, so `-c:a copy` can't pass YouTube's Opus through. Preferring
+    # Opus sources (see YTDL_OPTS) means FFmpeg only decodes, at the call's
+    # native 48 kHz, with no resampling step.
+    return AudioPiped(url, additional_ffmpeg_parameters=FFMPEG_PARAMS)
+
+# Errors that mean there is no call to play in, not a problem with the track
+_CALL_ERRORS = (GroupCallNotFoundError, NotInGroupCallError)
+
+async def _start_stream(chat_id: int, url: str) -> None:
+    # Try to join and start playing; if already in call, change stream
+    try:
+        await pytgcalls.join_group_call(chat_id, _audio(url))
+    except AlreadyJoinedError:
+        await pytgcalls.change_stream(chat_id, _audio(url))
+
+def _get_queue(chat_id: int) -> Deque[Track]:
+    return queues.setdefault(chat_id, deque())
+
+def _start_player(chat_id: int) -> None:
+    """Start the chat's _play_loop unless one is running or /leave is in progress."""
+    if chat_id in leaving:
+        return  # cmd_leave starts it once the call is gone
+    task = player_tasks.get(chat_id)
+    if task is None or task.done():
+        player_tasks[chat_id] = asyncio.create_task(_play_loop(chat_id))
+
+def _signal_end(chat_id: int) -> None:
+    """Wake the chat's _play_loop, if one is waiting on the current track."""
+    event = track_end.get(chat_id)
+    if event is not None:
+        event.set()
+
+def _notify(chat_id: int, text: str) -> None:
+    """Queue a notice for the chat; notices within NOTICE_DELAY go out as one message."""
+    pending = _notices.get(chat_id)
+    if pending is not None:
+        pending.append(text)
+        return
+    _notices[chat_id] = [text]
+    task = asyncio.create_task(_flush_notices(chat_id))
+    _notice_tasks.add(task)
+    task.add_done_callback(_notice_tasks.discard)
+
+async def _flush_notices(chat_id: int) -> None:
+    await asyncio.sleep(NOTICE_DELAY)
+    text = "\n".join(_notices.pop(chat_id))
+    try:
+        await app.send_message(chat_id, text)
+    except Exception:
+        pass
 
 async def _play_loop(chat_id: int) -> None:
-    """Plays queued tracks sequentially in a chat's voice chat."""
-    async with locks[chat_id]:
-        while queues[chat_id]:
-            track = queues[chat_id].popleft()
+    """Plays queued tracks sequentially in a chat's voice chat.
+
+    Runs as the chat's single player task (player_tasks); /leave cancels it.
+    """
+    queue = _get_queue(chat_id)
+    ended = track_end.get(chat_id) or track_end.setdefault(chat_id, asyncio.Event())
+    prefetch: Optional[asyncio.Task] = None
+    try:
+        while queue:
+            track = queue.popleft()
+            # A signal still set here was meant for an earlier track (e.g. a /skip
+            # of one that then failed to start); it must not skip this one
+            ended.clear()
             now_playing[chat_id] = track
             try:
-                # Try to join and start playing; if already in call, change stream
+                await _resolve(track)
                 try:
-                    await pytgcalls.join_group_call(chat_id, AudioPiped(track.url))
+                    await _start_stream(chat_id, track.url)
+                except _CALL_ERRORS:
+                    raise
                 except Exception:
-                    await pytgcalls.change_stream(chat_id, AudioPiped(track.url))
-            except GroupCallNotFoundError:
-                # No active voice chat; stop and inform
-                now_playing[chat_id] = None
+                    if time.monotonic() - track.resolved_at < STREAM_URL_FRESH:
+                        raise
+                    # An older (cached or prefetched) URL may have expired; resolve it once
+                    await _resolve(track, force=True)
+                    await _start_stream(chat_id, track.url)
+            except _CALL_ERRORS:
+                # No voice chat to play in; keep the queue and stop
+                queue.appendleft(track)
+                _notify(chat_id, "❌ No active voice chat. Start one, then `/play` again.")
                 return
-            except Exception:
+            except Exception as e:
+                # moves on to the next track
                 now_playing[chat_id] = None
-                # continue to next track
-                continue
+                _notify(chat_id, f"❌ Failed to play **{track.title}**: `{str(e) or type(e).__name__}`")
+            else:
+                # Resolve the next track while this one plays so the switch is instant
+                prefetch = asyncio.create_task(_resolve(queue[0])) if queue else None
 
-            # Wait until track finishes or /skip clears now_playing
-            # We poll every few seconds since we don't have end-of-stream hooks.
-            for _ in range(60 * 60 * 4):  # safety cap ~4h
-                await asyncio.sleep(5)
-                if now_playing[chat_id] is None:
-                    break
+                # Wait until the stream ends or /skip signals us
+                try:
+                    await asyncio.wait_for(ended.wait(), timeout=TRACK_MAX_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    ended.clear()
+                # Keep this before awaiting the prefetch: while we wait on it the
+                # track is over, and /skip must answer "Nothing to skip" rather
+                # than set a signal that would skip the next track instead
+                now_playing[chat_id] = None
 
-        # queue finished
-        try:
-            await pytgcalls.leave_group_call(chat_id)
-        except Exception:
-            pass
-        now_playing[chat_id] = None
+                if prefetch:
+                    try:
+                        await prefetch
+                    except Exception:
+                        pass  # retried when that track starts
+
+            if not queue:
+                # queue finished; anything /play adds while we leave is picked up above
+                now_playing[chat_id] = None
+                try:
+                    await pytgcalls.leave_group_call(chat_id)
+                except Exception:
+                    pass
+    finally:
+        if prefetch and not prefetch.done():
+            prefetch.cancel()
+        now_playing.pop(chat_id, None)
 
 # ── Commands ──────────────────────────────────────────────────────────────────
-@app.on_message(filters.command(["start", "help"]))
+# Filters are built once here rather than in each decorator
+CMD_HELP = filters.command(["start", "help"])
+CMD_JOIN = filters.command("join") & filters.group
+CMD_PLAY = filters.command("play") & filters.group
+CMD_QUEUE = filters.command("queue") & filters.group
+CMD_SKIP = filters.command("skip") & filters.group
+CMD_PAUSE = filters.command("pause") & filters.group
+CMD_RESUME = filters.command("resume") & filters.group
+CMD_LEAVE = filters.command("leave") & filters.group
+
+HELP_TEXT = (
+    "**Krishnavi Music Bot**\n\n"
+    "Add me to a group, start a voice chat, then use:\n"
+    "• `/play <song name | YouTube URL>` — queue a song\n"
+    "• `/queue` — show queue\n"
+    "• `/skip` — skip current track\n"
+    "• `/pause` / `/resume` — control playback\n"
+    "• `/leave` — leave voice chat\n\n"
+    "Tip: `/play https://youtu.be/...` also works."
+)
+
+@app.on_message(CMD_HELP)
 async def start_help(_, m: Message):
-    text = (
-        "**Krishnavi Music Bot**\n\n"
-        "Add me to a group, start a voice chat, then use:\n"
-        "• `/play <song name | YouTube URL>` — queue a song\n"
-        "• `/queue` — show queue\n"
-        "• `/skip` — skip current track\n"
-        "• `/pause` / `/resume` — control playback\n"
-        "• `/leave` — leave voice chat\n\n"
-        "Tip: `/play https://youtu.be/...` also works."
-    )
-    await m.reply_text(text)
+    await m.reply_text(HELP_TEXT)
 
-@app.on_message(filters.command("join") & filters.group)
+@app.on_message(CMD_JOIN)
 async def join_info(_, m: Message):
     await m.reply_text("Start a **voice chat** in this group first. Then just use `/play` — I will join automatically.")
 
-@app.on_message(filters.command("play") & filters.group)
+@app.on_message(CMD_PLAY)
 async def cmd_play(_, m: Message):
-    if len(m.command) < 2:
-        await m.reply_text("Usage: `/play <song name | YouTube URL>`", quote=True)
+    # Cut the command word off the raw text: m.command has quotes stripped
+    parts = m.text.split(None, 1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    error = _query_error(query)
+    if error:
+        await m.reply_text(error, quote=True)
         return
 
     cid = m.chat.id
-    query = m.text.split(None, 1)[1].strip()
-    status = await m.reply_text("🔎 Searching…")
+    requester = m.from_user.mention if m.from_user else "Someone"
+    # Extraction is deferred to _play_loop so queueing never waits on yt-dlp,
+    # but a cached result lets the reply show the real title right away
+    track = Track(query=query, requester=requester, title=query)
+    cached = _extract_cached(query)
+    if cached:
+        track.update(cached[1], cached[0])
+    _get_queue(cid).append(track)
+    await m.reply_text(
+        f"✅ Queued: **{track.title}**{f' `[{track.duration}]`' if track.duration else ''}\n"
+        f"Requested by {track.requester}"
+    )
 
-    try:
-        stream_url, title, duration, page_url = _ydl_extract(query)
-        requester = m.from_user.mention if m.from_user else "Someone"
-        track = Track(title=title, url=stream_url, page_url=page_url, requester=requester, duration=duration)
-        queues[cid].append(track)
-        await status.edit_text(
-            f"✅ Queued: **{track.title}** {f'`[{track.duration}]`' if track.duration else ''}\n"
-            f"Requested by {track.requester}"
-        )
-
-        if now_playing[cid] is None:
-            asyncio.create_task(_play_loop(cid))
-
-    except GroupCallNotFoundError:
-        await status.edit_text("❌ No active voice chat. Start one, then `/play` again.")
-    except Exception as e:
-        await status.edit_text(f"❌ Failed to queue: `{e}`")
+    _start_player(cid)
 
-@app.on_message(filters.command("queue") & filters.group)
+@app.on_message(CMD_QUEUE)
 async def cmd_queue(_, m: Message):
     cid = m.chat.id
-    np = now_playing[cid]
-    q = list(queues[cid])
+    np = now_playing.get(cid)
+    q = queues.get(cid) or ()  # iterated in place, no copy
     if not np and not q:
         await m.reply_text("🗒️ Queue is empty.")
         return
     lines = []
     if np:
-        lines.append(f"**Now Playing:** {np.title} {f'`[{np.duration}]`' if np.duration else ''}\n")
-    if q:
-        for i, t in enumerate(q, 1):
-            lines.append(f"{i}. {t.title} {f'`[{t.duration}]`' if t.duration else ''}")
+        lines.append(f"**Now Playing:** {np.display}\n")
+    lines.extend(f"{i}. {t.display}" for i, t in enumerate(q, 1))
     await m.reply_text("\n".join(lines))
 
-@app.on_message(filters.command("skip") & filters.group)
+@app.on_message(CMD_SKIP)
 async def cmd_skip(_, m: Message):
     cid = m.chat.id
-    if now_playing[cid] is None:
+    if now_playing.get(cid) is None:
         await m.reply_text("Nothing to skip.")
         return
-    # Signal loop to move on
-    now_playing[cid] = None
-    try:
-        if queues[cid]:
-            nxt = queues[cid][0]
-            await pytgcalls.change_stream(cid, AudioPiped(nxt.url))
-            await m.reply_text("⏭️ Skipping…")
-        else:
-            await pytgcalls.leave_group_call(cid)
-            await m.reply_text("⏹️ Stopped (queue ended).")
-    except (NotInGroupCallError, GroupCallNotFoundError):
-        await m.reply_text("Stopped.")
-    except Exception:
-        await m.reply_text("Skip failed, but I will try to continue.")
+    # Signal loop to move on; it starts the next track or leaves the call
+    _signal_end(cid)
+    if queues.get(cid):
+        await m.reply_text("⏭️ Skipping…")
+    else:
+        await m.reply_text("⏹️ Stopped (queue ended).")
 
-@app.on_message(filters.command("pause") & filters.group)
+@app.on_message(CMD_PAUSE)
 async def cmd_pause(_, m: Message):
     try:
         await pytgcalls.pause_stream(m.chat.id)
@@ -213,7 +436,7 @@ async def cmd_pause(_, m: Message):
     except Exception as e:
         await m.reply_text(f"Pause failed: `{e}`")
 
-@app.on_message(filters.command("resume") & filters.group)
+@app.on_message(CMD_RESUME)
 async def cmd_resume(_, m: Message):
     try:
         await pytgcalls.resume_stream(m.chat.id)
@@ -221,16 +444,40 @@ async def cmd_resume(_, m: Message):
     except Exception as e:
         await m.reply_text(f"Resume failed: `{e}`")
 
-@app.on_message(filters.command("leave") & filters.group)
+@app.on_message(CMD_LEAVE)
 async def cmd_leave(_, m: Message):
     cid = m.chat.id
-    queues[cid].clear()
-    now_playing[cid] = None
+    if cid in leaving:
+        await m.reply_text("Already leaving…")
+        return
+    leaving.add(cid)
     try:
-        await pytgcalls.leave_group_call(cid)
-        await m.reply_text("👋 Left the voice chat.")
-    except Exception as e:
-        await m.reply_text(f"Leave failed: `{e}`")
+        q = queues.get(cid)
+        if q:
+            q.clear()
+        task = player_tasks.get(cid)
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await pytgcalls.leave_group_call(cid)
+            await m.reply_text("👋 Left the voice chat.")
+        except Exception as e:
+            await m.reply_text(f"Leave failed: `{e}`")
+    finally:
+        leaving.discard(cid)
+        player_tasks.pop(cid, None)
+    # play whatever /play queued while we were leaving
+    if queues.get(cid):
+        _start_player(cid)
+
+# ── Call events ───────────────────────────────────────────────────────────────
+@pytgcalls.on_stream_end()
+async def on_stream_end(_, update):
+    _signal_end(update.chat_id)
 
 # ── Entrypoint ────────────────────────────────────────────────────────────────
 async def main():